@@ -4,17 +4,32 @@
 RupeeRocket - Refer & Earn Telegram Bot (final, fixed)
 """
 import os
+import io
+import json
+import logging
+import functools
+import contextvars
+import re
+import csv
+import html
+import time
+import asyncio
+import itertools
 import sqlite3
+from collections import deque
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
-from typing import List, Optional, Dict, Tuple
+from typing import Any, Awaitable, Callable, Iterator, List, Optional, Dict, Set, Tuple
 
 from dotenv import load_dotenv
-from pyrogram import Client, filters, enums
+from pyrogram import Client, filters, enums, idle
 from pyrogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton
 )
-from pyrogram.errors import UserNotParticipant
+from pyrogram.errors import UserNotParticipant, FloodWait
+from pyrogram.handlers import MessageHandler, CallbackQueryHandler
 
 load_dotenv()
 API_ID = int(os.getenv("API_ID", 23907288))
@@ -22,6 +37,23 @@ API_HASH = os.getenv("API_HASH", "f9a47570ed19aebf8eb0f0a5ec1111e5")
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8414309662:AAG3XoDlOE8DT5m6yWzr6C_iqFy-SjokzJE")
 OWNER_ID = int(os.getenv("OWNER_ID", 5748100919))
 DB_PATH = os.getenv("DB_PATH", "bot.db")
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")  # optional; falls back to the single bot above
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))         # idle connections kept per database
+SEND_RATE = float(os.getenv("SEND_RATE", 25))      # bot-wide messages/second
+CHAT_RATE = float(os.getenv("CHAT_RATE", 1))       # messages/second per chat
+CHAT_BURST = int(os.getenv("CHAT_BURST", 3))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 4))
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", 3))
+API_SLEEP_THRESHOLD = int(os.getenv("API_SLEEP_THRESHOLD", 10))  # FloodWait sleep for calls outside OUTBOX
+SCHED_WORKERS = int(os.getenv("SCHED_WORKERS", 16))     # users handled in parallel
+AUDIT_BATCH = int(os.getenv("AUDIT_BATCH", 50))          # flush after this many entries
+AUDIT_FLUSH_SECS = float(os.getenv("AUDIT_FLUSH_SECS", 5))
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "")    # empty = archive table lives in DB_PATH
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 500))
+ARCHIVE_EVERY_SECS = float(os.getenv("ARCHIVE_EVERY_SECS", 3600))
+BULK_CHUNK = int(os.getenv("BULK_CHUNK", 1000))          # rows per bulk transaction
+BULK_MAX_BYTES = int(os.getenv("BULK_MAX_BYTES", 20 * 1024 * 1024))
+BULK_MAX_AMOUNT = float(os.getenv("BULK_MAX_AMOUNT", 1_000_000))  # per-row cap for credit/debit
 
 DEFAULTS = {
     "DAILY_BONUS": "1",
@@ -30,16 +62,163 @@ DEFAULTS = {
     "CURRENCY": "₹",
     "WELCOME_TEXT": "Welcome to RupeeRocket! Earn by inviting friends.",
     "MAINTENANCE": "0",
-    "ACTIVE_DAYS": "30"
+    "ACTIVE_DAYS": "30",
+    "ARCHIVE_DAYS": "30"
 }
 
-STATE: Dict[int, Dict[str, str]] = {}
+log = logging.getLogger("rupeerocket")
+
+# ---------- Tenants ----------
+# Several bots can run in one process. Each tenant has its own Client and
+# database file (settings, channels, users, ...); the DB pool, outbound queue,
+# update scheduler and caches are shared. Code finds its tenant via TENANT.
+TENANT: contextvars.ContextVar = contextvars.ContextVar("tenant")
+TENANTS: List["Tenant"] = []
+
+class Tenant:
+    def __init__(self, name: str, bot_token: str, owner_id: int, db_path: str,
+                 api_id: int = API_ID, api_hash: str = API_HASH, archive_db_path: str = ""):
+        self.name = name
+        self.bot_token = bot_token
+        self.owner_id = owner_id
+        self.db_path = db_path
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.archive_db_path = archive_db_path
+        self.audit_buf: List[Tuple[str, int, str, Optional[int], Optional[str], Optional[str]]] = []
+        self.activity = Activity()
+        self.client: Optional[Client] = None
+
+    def build(self) -> Client:
+        self.client = Client(
+            name=self.name,
+            api_id=self.api_id,
+            api_hash=self.api_hash,
+            bot_token=self.bot_token,
+            parse_mode=enums.ParseMode.HTML,
+            sleep_threshold=0,  # FloodWait is handled by OUTBOX, not by sleeping inside a send
+        )
+        self.client.tenant = self
+        for cls, fn, flt in HANDLERS:
+            self.client.add_handler(cls(fn, flt))
+        return self.client
+
+def tenant() -> Tenant:
+    return TENANT.get()
+
+@contextmanager
+def use_tenant(t: Tenant):
+    token = TENANT.set(t)
+    try:
+        yield t
+    finally:
+        TENANT.reset(token)
+
+def load_tenants(path: str = TENANTS_FILE) -> List[Tenant]:
+    """Read tenants from a JSON list of {name, bot_token, owner_id, db_path, ...}, else use env."""
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            cfg = json.load(f)
+        tenants = [Tenant(c["name"], c["bot_token"], int(c["owner_id"]), c.get("db_path") or f"{c['name']}.db",
+                          int(c.get("api_id") or API_ID), c.get("api_hash") or API_HASH,
+                          c.get("archive_db_path", ""))
+                   for c in cfg]
+    else:
+        tenants = [Tenant("rupeerocket_bot", BOT_TOKEN, OWNER_ID, DB_PATH, archive_db_path=ARCHIVE_DB_PATH)]
+    # Shared caches, rate buckets and session files are keyed by name, and
+    # archive ids collide across tenants, so none of these may repeat.
+    names = [t.name for t in tenants]
+    paths = [os.path.abspath(p) for t in tenants for p in (t.db_path, t.archive_db_path) if p]
+    for what, vals in (("name", names), ("db_path/archive_db_path", paths)):
+        dups = sorted({v for v in vals if vals.count(v) > 1})
+        if dups:
+            raise SystemExit(f"{path}: duplicate tenant {what}: {', '.join(dups)}")
+    TENANTS[:] = tenants
+    return tenants
+
+class TenantMap(MutableMapping):
+    """A dict scoped to the current tenant over storage shared by all tenants.
+    len() and clear() act on the shared storage."""
+
+    def __init__(self):
+        self.data: Dict[Tuple[str, Any], Any] = {}
+
+    def __getitem__(self, key):
+        return self.data[(tenant().name, key)]
+
+    def __setitem__(self, key, value):
+        self.data[(tenant().name, key)] = value
+
+    def __delitem__(self, key):
+        del self.data[(tenant().name, key)]
+
+    def __iter__(self):
+        name = tenant().name
+        return (k for t, k in list(self.data) if t == name)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+STATE = TenantMap()
 
 # ---------- DB ----------
+class PooledConnection(sqlite3.Connection):
+    """close() hands the connection back to POOL instead of closing it."""
+    pool_key: Tuple[str, str] = ("", "")
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+        POOL.put(self)
+
+    def discard(self):
+        sqlite3.Connection.close(self)
+
+class ConnectionPool:
+    def __init__(self, size: int = DB_POOL_SIZE):
+        self.size = size
+        self.idle: Dict[Tuple[str, str], List[PooledConnection]] = {}
+
+    def get(self, path: str, archive: str = "") -> PooledConnection:
+        key = (path, archive)
+        free = self.idle.get(key)
+        if free:
+            return free.pop()
+        con = sqlite3.connect(path, factory=PooledConnection)
+        con.row_factory = sqlite3.Row
+        con.pool_key = key
+        if archive:
+            con.execute("ATTACH DATABASE ? AS archive", (archive,))
+        return con
+
+    def put(self, con: PooledConnection):
+        free = self.idle.setdefault(con.pool_key, [])
+        if len(free) < self.size:
+            free.append(con)
+        else:
+            con.discard()
+
+    def close_all(self):
+        for free in self.idle.values():
+            for con in free:
+                con.discard()
+        self.idle.clear()
+
+POOL = ConnectionPool()
+
 def db() -> sqlite3.Connection:
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    return con
+    return POOL.get(tenant().db_path)
+
+def db_wd() -> sqlite3.Connection:
+    """Connection that can see both withdrawals and wd_archive()."""
+    t = tenant()
+    return POOL.get(t.db_path, t.archive_db_path)
+
+def wd_archive() -> str:
+    return "archive.withdrawals_archive" if tenant().archive_db_path else "withdrawals_archive"
 
 def init_db():
     con = db(); cur = con.cursor()
@@ -53,9 +232,47 @@ def init_db():
             verified INTEGER DEFAULT 0,
             referred_bonus_paid INTEGER DEFAULT 0,
             is_banned INTEGER DEFAULT 0,
-            last_seen TEXT
+            last_seen TEXT,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT
         )
     """)
+    cols = {r[1] for r in cur.execute("PRAGMA table_info(users)")}
+    for col in ("username", "first_name", "last_name"):
+        if col not in cols:
+            cur.execute(f"ALTER TABLE users ADD COLUMN {col} TEXT")
+    # External-content FTS5 index over profile fields, kept in sync by triggers.
+    fts_new = cur.execute("SELECT 1 FROM sqlite_master WHERE name='users_fts'").fetchone() is None
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username, first_name, last_name,
+            content='users', content_rowid='user_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts(rowid, username, first_name, last_name)
+            VALUES (new.user_id, new.username, new.first_name, new.last_name);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name)
+            VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, first_name, last_name ON users BEGIN
+            INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name)
+            VALUES ('delete', old.user_id, old.username, old.first_name, old.last_name);
+            INSERT INTO users_fts(rowid, username, first_name, last_name)
+            VALUES (new.user_id, new.username, new.first_name, new.last_name);
+        END
+    """)
+    if fts_new:
+        cur.execute("INSERT INTO users_fts(users_fts) VALUES('rebuild')")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS channels (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -83,26 +300,75 @@ def init_db():
             created_at TEXT
         )
     """)
+    con.commit(); con.close()
+    con = db_wd(); cur = con.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {wd_archive()} (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            amount REAL,
+            upi TEXT,
+            status TEXT,
+            created_at TEXT
+        )
+    """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {wd_archive()}_user ON withdrawals_archive(user_id)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts TEXT,
+            actor INTEGER,
+            action TEXT,
+            target INTEGER,
+            before TEXT,
+            after TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit_log(actor, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_target ON audit_log(target, id)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_seq (
+            idx INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS activity (
+            day TEXT PRIMARY KEY,
+            bits BLOB,
+            first_idx INTEGER
+        )
+    """)
+    # One-time backfill for users that predate user_seq; new users get an index on join.
+    if cur.execute("SELECT COUNT(*) FROM user_seq").fetchone()[0] < cur.execute("SELECT COUNT(*) FROM users").fetchone()[0]:
+        cur.execute("INSERT OR IGNORE INTO user_seq(user_id) SELECT user_id FROM users ORDER BY joined_at")
     for k, v in DEFAULTS.items():
         cur.execute("INSERT OR IGNORE INTO settings(key,value) VALUES(?,?)", (k, v))
-    if OWNER_ID:
-        cur.execute("INSERT OR IGNORE INTO admins(user_id) VALUES(?)", (OWNER_ID,))
+    if tenant().owner_id:
+        cur.execute("INSERT OR IGNORE INTO admins(user_id) VALUES(?)", (tenant().owner_id,))
     con.commit(); con.close()
 
 # ---------- Helpers ----------
+# Settings are read on nearly every update; cache them (per tenant) until set_setting.
+SETTINGS = TenantMap()
+
 def get_setting(key: str) -> str:
+    if key in SETTINGS:
+        return SETTINGS[key]
     con = db(); cur = con.cursor()
     cur.execute("SELECT value FROM settings WHERE key=?", (key,))
     row = cur.fetchone(); con.close()
-    return row[0] if row else DEFAULTS.get(key, "")
+    val = SETTINGS[key] = row[0] if row else DEFAULTS.get(key, "")
+    return val
 
 def set_setting(key: str, val: str):
     con = db(); cur = con.cursor()
     cur.execute("REPLACE INTO settings(key,value) VALUES(?,?)", (key, val))
     con.commit(); con.close()
+    SETTINGS[key] = val
 
 def is_admin(uid: int) -> bool:
-    if uid == OWNER_ID:
+    if uid == tenant().owner_id:
         return True
     con = db(); cur = con.cursor()
     cur.execute("SELECT 1 FROM admins WHERE user_id=?", (uid,))
@@ -116,15 +382,21 @@ def add_user_if_absent(uid: int, ref: Optional[int]) -> Tuple[bool, Optional[int
     if row:
         cur.execute("UPDATE users SET last_seen=? WHERE user_id=?", (datetime.utcnow().isoformat(), uid))
         con.commit(); con.close(); return False, row[0]
+    tenant().activity.roll()  # open today's cohort before this user takes an index
     cur.execute("INSERT INTO users(user_id, joined_at, referrer_id, balance, last_seen) VALUES(?,?,?,?,?)",
                 (uid, datetime.utcnow().isoformat(), ref, 0.0, datetime.utcnow().isoformat()))
+    cur.execute("INSERT OR IGNORE INTO user_seq(user_id) VALUES(?)", (uid,))
     con.commit(); con.close()
     return True, ref
 
 def mark_seen(uid: int):
     con = db(); cur = con.cursor()
     cur.execute("UPDATE users SET last_seen=? WHERE user_id=?", (datetime.utcnow().isoformat(), uid))
+    cur.execute("SELECT idx FROM user_seq WHERE user_id=?", (uid,))
+    row = cur.fetchone()
     con.commit(); con.close()
+    if row:
+        tenant().activity.mark(row[0])
 
 def credit(uid: int, amt: float):
     con = db(); cur = con.cursor()
@@ -229,14 +501,593 @@ def set_ref_bonus_paid(uid: int):
     cur.execute("UPDATE users SET referred_bonus_paid=1 WHERE user_id=?", (uid,))
     con.commit(); con.close()
 
+# Last profile written per user, so unchanged profiles cost no DB round-trip.
+PROFILES = TenantMap()
+
+def save_profile(u) -> None:
+    """Store username/first/last name from a pyrogram User, only when they changed."""
+    if u is None:
+        return
+    prof = (u.username, u.first_name, u.last_name)
+    if PROFILES.get(u.id) == prof:
+        return
+    con = db(); cur = con.cursor()
+    cur.execute(
+        "UPDATE users SET username=?, first_name=?, last_name=? WHERE user_id=? "
+        "AND (username IS NOT ? OR first_name IS NOT ? OR last_name IS NOT ?)",
+        prof + (u.id,) + prof
+    )
+    # Nothing updated: either unchanged or the user has no row yet. Only the
+    # former may be cached, or a later /start would skip the first write.
+    exists = cur.rowcount > 0 or cur.execute("SELECT 1 FROM users WHERE user_id=?", (u.id,)).fetchone() is not None
+    con.commit(); con.close()
+    if not exists:
+        return
+    if len(PROFILES) > 100000:
+        PROFILES.clear()
+    PROFILES[u.id] = prof
+
+def _fts_query(text: str) -> str:
+    # Every word becomes a quoted prefix term; terms are AND-ed.
+    terms = [t.lstrip("@").replace('"', '""') for t in text.split()]
+    return " ".join(f'"{t}"*' for t in terms if t)
+
+def search_users(text: str, page: int = 0, per_page: int = 10) -> Tuple[List[sqlite3.Row], bool]:
+    """Prefix search over username/first/last name. Returns (rows, has_more)."""
+    q = _fts_query(text)
+    if not q:
+        return [], False
+    con = db(); cur = con.cursor()
+    # No rank ordering: rowid order streams straight off the index, so
+    # broad prefixes stay fast on millions of rows.
+    cur.execute(
+        "SELECT u.user_id, u.username, u.first_name, u.last_name, u.balance FROM users_fts f "
+        "JOIN users u ON u.user_id = f.rowid WHERE users_fts MATCH ? LIMIT ? OFFSET ?",
+        (q, per_page + 1, page * per_page)
+    )
+    rows = cur.fetchall(); con.close()
+    return rows[:per_page], len(rows) > per_page
+
+# ---------- Activity Bitmaps ----------
+# One bitset per UTC day, bit i set when the user with dense index i (user_seq)
+# was seen. Held as a bytearray for today and as Python ints for set algebra.
+def popcount(x: int) -> int:
+    return x.bit_count()
+
+class Activity:
+    def __init__(self):
+        self.day: Optional[str] = None
+        self.bits = bytearray()
+        self.dirty = False
+        self.cache: Dict[str, int] = {}   # past days never change once rolled over
+
+    def roll(self):
+        today = datetime.utcnow().date().isoformat()
+        if today == self.day:
+            return
+        if self.day:
+            self.flush()
+        con = db(); cur = con.cursor()
+        # first_idx marks where today's join cohort starts in the dense index.
+        cur.execute("INSERT OR IGNORE INTO activity(day, bits, first_idx) "
+                    "VALUES(?, x'', (SELECT COALESCE(MAX(idx),0)+1 FROM user_seq))", (today,))
+        cur.execute("SELECT bits FROM activity WHERE day=?", (today,))
+        self.bits = bytearray(cur.fetchone()[0] or b"")
+        con.commit(); con.close()
+        self.day = today
+        self.dirty = False
+        if len(self.cache) > 400:
+            self.cache.clear()
+
+    def mark(self, idx: int):
+        self.roll()
+        byte, bit = divmod(idx, 8)
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        if not self.bits[byte] >> bit & 1:
+            self.bits[byte] |= 1 << bit
+            self.dirty = True
+
+    def flush(self):
+        if not self.dirty:
+            return
+        con = db()
+        con.execute("UPDATE activity SET bits=? WHERE day=?", (bytes(self.bits), self.day))
+        con.commit(); con.close()
+        self.dirty = False
+
+    def day_bits(self, day: str) -> int:
+        self.roll()
+        if day == self.day:
+            return int.from_bytes(self.bits, "little")
+        if day not in self.cache:
+            con = db()
+            row = con.execute("SELECT bits FROM activity WHERE day=?", (day,)).fetchone()
+            con.close()
+            if not row:
+                return 0
+            self.cache[day] = int.from_bytes(row[0] or b"", "little")
+        return self.cache[day]
+
+    def last_days(self, n: int, end: Optional[date] = None) -> List[str]:
+        end = end or datetime.utcnow().date()
+        return [(end - timedelta(days=i)).isoformat() for i in range(n)]
+
+    def union(self, days: List[str]) -> int:
+        acc = 0
+        for d in days:
+            acc |= self.day_bits(d)
+        return acc
+
+    def active(self, n: int) -> int:
+        """Distinct users seen in the last n days, today included."""
+        return popcount(self.union(self.last_days(n)))
+
+    def coverage(self) -> int:
+        """How many days back bitmaps exist (today counts as 1)."""
+        con = db()
+        row = con.execute("SELECT MIN(day) FROM activity").fetchone()
+        con.close()
+        if not row[0]:
+            return 0
+        return (datetime.utcnow().date() - date.fromisoformat(row[0])).days + 1
+
+    def cohort(self, day: str) -> int:
+        """Bitmask of users who joined on `day`."""
+        con = db()
+        lo = con.execute("SELECT first_idx FROM activity WHERE day=?", (day,)).fetchone()
+        hi = con.execute("SELECT first_idx FROM activity WHERE day>? ORDER BY day LIMIT 1", (day,)).fetchone()
+        if lo and not hi:
+            hi = con.execute("SELECT COALESCE(MAX(idx),0)+1 FROM user_seq").fetchone()
+        con.close()
+        if not lo or lo[0] is None or hi[0] <= lo[0]:
+            return 0
+        return (1 << hi[0]) - (1 << lo[0])
+
+    def retention(self, day: str, after: int) -> Tuple[int, int]:
+        """(cohort size, members of `day`'s join cohort seen `after` days later)."""
+        mask = self.cohort(day)
+        later = (date.fromisoformat(day) + timedelta(days=after)).isoformat()
+        return popcount(mask), popcount(mask & self.day_bits(later))
+
+    def audience(self, n: int) -> List[int]:
+        """user_ids seen in the last n days, resolved through user_seq."""
+        raw = self.union(self.last_days(n))
+        idxs = []
+        for i, b in enumerate(raw.to_bytes((raw.bit_length() + 7) // 8, "little")):
+            if b:
+                idxs.extend(i * 8 + k for k in range(8) if b >> k & 1)
+        users = []
+        con = db()
+        for i in range(0, len(idxs), 500):
+            part = idxs[i:i + 500]
+            users += [r[0] for r in con.execute(f"SELECT user_id FROM user_seq WHERE idx IN ({','.join('?' * len(part))})", part)]
+        con.close()
+        return users
+
+async def activity_flusher():
+    while True:
+        await asyncio.sleep(AUDIT_FLUSH_SECS)
+        for t in TENANTS:
+            with use_tenant(t):
+                try:
+                    t.activity.flush()
+                except Exception:
+                    pass
+
+# ---------- Withdrawals Archive ----------
+# Settled withdrawals older than ARCHIVE_DAYS move to wd_archive() so the hot
+# table only holds recent/pending rows. Reads that need history use wd_all().
+WD_COLS = "id,user_id,amount,upi,status,created_at"
+
+def wd_all() -> str:
+    return f"SELECT {WD_COLS} FROM withdrawals UNION ALL SELECT {WD_COLS} FROM {wd_archive()}"
+
+def get_withdrawal(wid: int) -> Optional[sqlite3.Row]:
+    con = db(); cur = con.cursor()
+    cur.execute(f"SELECT {WD_COLS} FROM withdrawals WHERE id=?", (wid,))
+    r = cur.fetchone(); con.close()
+    if r:
+        return r
+    con = db_wd(); cur = con.cursor()
+    cur.execute(f"SELECT {WD_COLS} FROM {wd_archive()} WHERE id=?", (wid,))
+    r = cur.fetchone(); con.close()
+    return r
+
+def user_withdrawals(uid: int, limit: int = 5) -> List[sqlite3.Row]:
+    con = db_wd(); cur = con.cursor()
+    cur.execute(f"SELECT * FROM ({wd_all()}) WHERE user_id=? ORDER BY id DESC LIMIT ?", (uid, limit))
+    rows = cur.fetchall(); con.close()
+    return rows
+
+def archive_withdrawals(days: int, batch: int = ARCHIVE_BATCH) -> int:
+    """Move one batch of settled rows older than `days`; returns rows moved."""
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    cond = "status IN ('approved','rejected') AND created_at < ?"
+    con = db_wd()
+    try:
+        with con:
+            row = con.execute(f"SELECT MAX(id) FROM (SELECT id FROM withdrawals WHERE {cond} ORDER BY id LIMIT ?)",
+                              (cutoff, batch)).fetchone()
+            if row[0] is None:
+                return 0
+            # The first `batch` matches are exactly the matches with id <= their max id.
+            con.execute(f"INSERT OR REPLACE INTO {wd_archive()}({WD_COLS}) SELECT {WD_COLS} FROM withdrawals WHERE {cond} AND id <= ?",
+                        (cutoff, row[0]))
+            return con.execute(f"DELETE FROM withdrawals WHERE {cond} AND id <= ?", (cutoff, row[0])).rowcount
+    finally:
+        con.close()
+
+async def archiver():
+    while True:
+        for t in TENANTS:
+            with use_tenant(t):
+                try:
+                    days = int(get_setting("ARCHIVE_DAYS") or "0")
+                    while days > 0 and archive_withdrawals(days):
+                        await asyncio.sleep(0)
+                except Exception:
+                    pass
+        await asyncio.sleep(ARCHIVE_EVERY_SECS)
+
+# ---------- Outbound Queue ----------
+# Every send goes through one priority queue. Lower number = served first.
+PRIO_REPLY = 0    # interactive replies/edits to the user who just acted
+PRIO_ADMIN = 1    # admin notifications
+PRIO_NOTIFY = 2   # user notifications (referral, withdrawal result)
+PRIO_BULK = 3     # broadcasts
+
+class TokenBucket:
+    """Classic token bucket; take() returns 0 when a token was consumed, else seconds to wait."""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self) -> float:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float):
+        # Drain the bucket so the next token only appears after `seconds` (FloodWait).
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+class _Job:
+    __slots__ = ("bot", "chat_id", "fn", "args", "kwargs", "future", "attempts")
+
+    def __init__(self, bot: str, chat_id: int, fn: Callable[..., Awaitable[Any]], args: tuple, kwargs: dict, future: asyncio.Future):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+class Outbox:
+    """Prioritized outbound queue with a per-bot + per-chat rate governor and FloodWait retries.
+    One instance serves every tenant; Telegram limits are per bot token, so buckets are keyed by bot."""
+
+    def __init__(self, workers: int = SEND_WORKERS, rate: float = SEND_RATE,
+                 chat_rate: float = CHAT_RATE, chat_burst: int = CHAT_BURST):
+        self.workers = workers
+        self.rate = rate
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats: Dict[Tuple[str, int], TokenBucket] = {}
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.seq = itertools.count()
+
+    def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, chat_id: int, prio: int, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> asyncio.Future:
+        """Queue fn(*args, **kwargs) for chat_id; the returned future resolves with its result."""
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        t = TENANT.get(None)
+        self.queue.put_nowait((prio, next(self.seq), _Job(t.name if t else "", chat_id, fn, args, kwargs, fut)))
+        return fut
+
+    async def send(self, chat_id: int, prio: int, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        return await self.submit(chat_id, prio, fn, *args, **kwargs)
+
+    def _bot(self, bot: str) -> TokenBucket:
+        b = self.buckets.get(bot)
+        if b is None:
+            b = self.buckets[bot] = TokenBucket(self.rate, max(1, int(self.rate)))
+        return b
+
+    def _chat(self, bot: str, chat_id: int) -> TokenBucket:
+        b = self.chats.get((bot, chat_id))
+        if b is None:
+            if len(self.chats) > 10000:
+                self.chats = {k: v for k, v in self.chats.items() if not v.idle()}
+            b = self.chats[(bot, chat_id)] = TokenBucket(self.chat_rate, self.chat_burst)
+        return b
+
+    def _later(self, delay: float, item: tuple):
+        asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, item)
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self._dispatch(item)
+            finally:
+                self.queue.task_done()
+
+    async def _dispatch(self, item: tuple):
+        prio, seq, job = item
+        if job.future.done():
+            return
+        wait = self._chat(job.bot, job.chat_id).take()
+        if wait > 0:
+            # Keep the original seq so the message keeps its place within the chat.
+            return self._later(wait, item)
+        bucket = self._bot(job.bot)
+        wait = bucket.take()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = bucket.take()
+        try:
+            res = await job.fn(*job.args, **job.kwargs)
+        except FloodWait as e:
+            delay = float(getattr(e, "value", 1) or 1)
+            self._chat(job.bot, job.chat_id).block(delay)
+            if prio == PRIO_BULK:
+                # A bulk run hitting flood limits means the bot as a whole is too fast.
+                self._bot(job.bot).block(delay)
+            job.attempts += 1
+            if job.attempts <= SEND_RETRIES:
+                return self._later(delay, item)
+            if not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(res)
+
+OUTBOX = Outbox()
+
+async def api(fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+    """Call a non-send API method, sleeping through short FloodWaits.
+    Clients run with sleep_threshold=0 so OUTBOX sees every FloodWait; this
+    restores pyrogram's default behaviour for everything else."""
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except FloodWait as e:
+            delay = float(getattr(e, "value", 1) or 1)
+            if delay > API_SLEEP_THRESHOLD:
+                raise
+            await asyncio.sleep(delay)
+_TASKS: Set[asyncio.Task] = set()
+
+def _quiet(fut: asyncio.Future):
+    # Fire-and-forget sends swallow errors, like the old try/except: pass blocks.
+    if not fut.cancelled():
+        fut.exception()
+
+def spawn(coro: Awaitable[Any]) -> asyncio.Task:
+    t = asyncio.get_running_loop().create_task(coro)
+    _TASKS.add(t)
+    t.add_done_callback(_TASKS.discard)
+    return t
+
+def post(chat_id: int, text: str, prio: int = PRIO_NOTIFY, **kw) -> asyncio.Future:
+    """Fire-and-forget send_message; never blocks the handler."""
+    fut = OUTBOX.submit(chat_id, prio, tenant().client.send_message, chat_id, text, **kw)
+    fut.add_done_callback(_quiet)
+    return fut
+
+async def reply(m: Message, text: str, **kw):
+    return await OUTBOX.send(m.chat.id, PRIO_REPLY, m.reply_text, text, **kw)
+
+async def edit(m: Message, text: str, **kw):
+    return await OUTBOX.send(m.chat.id, PRIO_REPLY, m.edit_text, text, **kw)
+
+async def reply_doc(m: Message, path: str, **kw):
+    return await OUTBOX.send(m.chat.id, PRIO_REPLY, m.reply_document, path, **kw)
+
+# ---------- Update Scheduler ----------
+# Updates for the same user (per tenant) run strictly in arrival order; different
+# users run in parallel on SCHED_WORKERS tasks. A lane exists only while it has work.
+_LANE: contextvars.ContextVar = contextvars.ContextVar("lane", default=None)
+
+class KeyedScheduler:
+    def __init__(self, workers: int = SCHED_WORKERS):
+        self.workers = workers
+        self.lanes: Dict[Any, deque] = {}
+        self.ready: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.pending = 0
+        self.busy = 0
+        self.done = 0
+        self.wait_avg = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        if self.tasks:
+            return
+        self.ready = asyncio.Queue()
+        self.tasks = [asyncio.get_running_loop().create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, key: Any, fn: Callable[..., Awaitable[Any]], *args):
+        self.start()
+        job = (fn, args, time.monotonic())
+        self.pending += 1
+        lane = self.lanes.get(key)
+        if lane is None:
+            self.lanes[key] = deque([job])
+            self.ready.put_nowait(key)
+        else:
+            # Lane is queued or running; its worker will pick this up in order.
+            lane.append(job)
+
+    async def _worker(self):
+        while True:
+            key = await self.ready.get()
+            lane = self.lanes[key]
+            fn, args, queued = lane.popleft()
+            self.pending -= 1
+            wait = time.monotonic() - queued
+            self.wait_avg = wait if not self.done else self.wait_avg * 0.95 + wait * 0.05
+            self.wait_max = max(self.wait_max, wait)
+            self.busy += 1
+            token = _LANE.set(key)
+            try:
+                await fn(*args)
+            except Exception:
+                log.exception("update handler failed (lane %s)", key)
+            finally:
+                _LANE.reset(token)
+                self.busy -= 1
+                self.done += 1
+            # One job per turn keeps a chatty user from hogging a worker.
+            if lane:
+                self.ready.put_nowait(key)
+            else:
+                del self.lanes[key]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "lanes": len(self.lanes),
+            "pending": self.pending,
+            "deepest_lane": max((len(l) for l in self.lanes.values()), default=0),
+            "done": self.done,
+            "wait_avg_ms": round(self.wait_avg * 1000, 1),
+            "wait_max_ms": round(self.wait_max * 1000, 1),
+        }
+
+SCHED = KeyedScheduler()
+
+def serialized(fn):
+    """Run a handler on the sender's lane instead of pyrogram's worker."""
+    @functools.wraps(fn)
+    async def wrapper(client: Client, update):
+        t = client.tenant
+        key = (t.name, update.from_user.id if update.from_user else 0)
+        if _LANE.get() == key:
+            # Re-entrant call from inside the same lane (e.g. admin_callbacks redraw).
+            return await fn(client, update)
+        SCHED.submit(key, _in_tenant, t, fn, client, update)
+    return wrapper
+
+async def _in_tenant(t: Tenant, fn: Callable[..., Awaitable[Any]], *args):
+    with use_tenant(t):
+        await fn(*args)
+
+# ---------- Audit Log ----------
+# Admin actions are buffered in memory (per tenant) and written in one transaction per batch.
+
+def audit(actor: int, action: str, target: Optional[int] = None, before=None, after=None):
+    buf = tenant().audit_buf
+    buf.append((datetime.utcnow().isoformat(), actor, action, target,
+                      None if before is None else str(before),
+                      None if after is None else str(after)))
+    if len(buf) >= AUDIT_BATCH:
+        try:
+            flush_audit()
+        except Exception:
+            log.exception("audit flush failed; will retry")
+
+def flush_audit():
+    buf = tenant().audit_buf
+    if not buf:
+        return
+    rows = buf[:]
+    con = db()
+    try:
+        with con:
+            con.executemany("INSERT INTO audit_log(ts, actor, action, target, before, after) VALUES(?,?,?,?,?,?)", rows)
+    finally:
+        con.close()
+    # Drop entries only once they are committed; on failure they stay for the next flush.
+    del buf[:len(rows)]
+
+async def audit_flusher():
+    while True:
+        await asyncio.sleep(AUDIT_FLUSH_SECS)
+        for t in TENANTS:
+            with use_tenant(t):
+                try:
+                    flush_audit()
+                except Exception:
+                    log.exception("audit flush failed for %s; will retry", t.name)
+
+def query_audit(actor: Optional[int] = None, target: Optional[int] = None, limit: int = 20) -> List[sqlite3.Row]:
+    flush_audit()
+    con = db(); cur = con.cursor()
+    if actor is not None:
+        cur.execute("SELECT * FROM audit_log WHERE actor=? ORDER BY id DESC LIMIT ?", (actor, limit))
+    elif target is not None:
+        cur.execute("SELECT * FROM audit_log WHERE target=? ORDER BY id DESC LIMIT ?", (target, limit))
+    else:
+        cur.execute("SELECT * FROM audit_log ORDER BY id DESC LIMIT ?", (limit,))
+    rows = cur.fetchall(); con.close()
+    return rows
+
+def fmt_audit(r: sqlite3.Row) -> str:
+    line = f"#{r['id']} {r['ts'][:19]} {r['actor']} <b>{r['action']}</b>"
+    if r["target"] is not None:
+        line += f" → {r['target']}"
+    if r["before"] is not None or r["after"] is not None:
+        line += f": {html.escape(str(r['before'])[:80])} ⇒ {html.escape(str(r['after'])[:80])}"
+    return line
+
 # ---------- Bot ----------
-app = Client(
-    name="rupeerocket_bot",
-    api_id=API_ID,
-    api_hash=API_HASH,
-    bot_token=BOT_TOKEN,
-    parse_mode=enums.ParseMode.HTML,
-)
+# Handlers are collected here and attached to every tenant's Client in Tenant.build().
+HANDLERS: List[Tuple[type, Callable, Any]] = []
+
+def on_message(flt=None):
+    def deco(fn):
+        HANDLERS.append((MessageHandler, fn, flt))
+        return fn
+    return deco
+
+def on_callback_query(flt=None):
+    def deco(fn):
+        HANDLERS.append((CallbackQueryHandler, fn, flt))
+        return fn
+    return deco
 
 # Reply keyboard for users
 def user_keyboard() -> ReplyKeyboardMarkup:
@@ -261,6 +1112,8 @@ def admin_menu() -> InlineKeyboardMarkup:
          InlineKeyboardButton("➕➖ Balance", callback_data="A:BALSET")],
         [InlineKeyboardButton("🔎 Lookup User", callback_data="A:LOOKUP"),
          InlineKeyboardButton("📤 Export", callback_data="A:EXPORT")],
+        [InlineKeyboardButton("📜 Audit Log", callback_data="A:AUDIT"),
+         InlineKeyboardButton("📈 Stats", callback_data="A:STATS")],
         [InlineKeyboardButton("🧰 Owner Tools", callback_data="A:OWNER")]
     ])
 
@@ -268,8 +1121,9 @@ async def ensure_joined(user_id: int) -> List[str]:
     missing: List[str] = []
     for ch in list_channels():
         try:
-            await app.get_chat_member(ch, user_id)
-        except UserNotParticipant:
+            await api(tenant().client.get_chat_member, ch, user_id)
+        except (UserNotParticipant, FloodWait):
+            # A long FloodWait means we couldn't check; never count that as joined.
             missing.append(ch)
         except Exception:
             pass
@@ -278,10 +1132,10 @@ async def ensure_joined(user_id: int) -> List[str]:
 async def send_join_prompt(chat_id: int):
     chans = list_channels()
     if not chans:
-        return await app.send_message(chat_id, "No required channels set by admin.")
+        return await OUTBOX.send(chat_id, PRIO_REPLY, tenant().client.send_message, chat_id, "No required channels set by admin.")
     rows = [[InlineKeyboardButton(ch, url=f"https://t.me/{ch.lstrip('@')}")] for ch in chans]
     rows.append([InlineKeyboardButton("✅ I've joined", callback_data="U:JOINED")])
-    await app.send_message(chat_id, "Please join all channels to continue:", reply_markup=InlineKeyboardMarkup(rows))
+    await OUTBOX.send(chat_id, PRIO_REPLY, tenant().client.send_message, chat_id, "Please join all channels to continue:", reply_markup=InlineKeyboardMarkup(rows))
 
 async def maybe_verify_and_credit(uid: int):
     user = get_user(uid)
@@ -297,15 +1151,13 @@ async def maybe_verify_and_credit(uid: int):
                 amt = float(get_setting("REFERRAL_BONUS"))
                 credit(user["referrer_id"], amt)
                 set_ref_bonus_paid(uid)
-                try:
-                    await app.send_message(user["referrer_id"], f"🎉 Your referral verified! +{get_setting('CURRENCY')}{amt:.2f}")
-                except Exception:
-                    pass
+                post(user["referrer_id"], f"🎉 Your referral verified! +{get_setting('CURRENCY')}{amt:.2f}")
             except Exception:
                 pass
 
 # ---------- User Handlers ----------
-@app.on_message(filters.command("start"))
+@on_message(filters.command("start"))
+@serialized
 async def start_cmd(client: Client, m: Message):
     args = m.text.split(maxsplit=1)
     referrer_id = None
@@ -315,34 +1167,36 @@ async def start_cmd(client: Client, m: Message):
             referrer_id = rid
 
     is_new, saved_ref = add_user_if_absent(m.from_user.id, referrer_id)
+    save_profile(m.from_user)
     mark_seen(m.from_user.id)
 
     if get_setting("MAINTENANCE") == "1" and not is_admin(m.from_user.id):
-        return await m.reply_text("🚧 Bot is under maintenance. Please try again later.")
+        return await reply(m, "🚧 Bot is under maintenance. Please try again later.")
 
     if is_banned(m.from_user.id):
-        return await m.reply_text("🚫 You are banned from using this bot.")
+        return await reply(m, "🚫 You are banned from using this bot.")
 
     need = await ensure_joined(m.from_user.id)
     welcome = get_setting("WELCOME_TEXT")
     if need:
-        await m.reply_text(f"{welcome}\n\nYou must join required channels first.", reply_markup=user_keyboard())
+        await reply(m, f"{welcome}\n\nYou must join required channels first.", reply_markup=user_keyboard())
         return await send_join_prompt(m.chat.id)
 
     await maybe_verify_and_credit(m.from_user.id)
-    await m.reply_text(f"{welcome}\n\nUse the menu below.", reply_markup=user_keyboard())
+    await reply(m, f"{welcome}\n\nUse the menu below.", reply_markup=user_keyboard())
 
-@app.on_callback_query(filters.regex(r"^U:JOINED$"))
+@on_callback_query(filters.regex(r"^U:JOINED$"))
+@serialized
 async def joined_confirm(client: Client, cq: CallbackQuery):
     uid = cq.from_user.id
     if is_banned(uid):
-        return await cq.answer("Banned.", show_alert=True)
+        return await api(cq.answer, "Banned.", show_alert=True)
     need = await ensure_joined(uid)
     if need:
-        return await cq.answer("Still missing some channels.", show_alert=True)
+        return await api(cq.answer, "Still missing some channels.", show_alert=True)
     await maybe_verify_and_credit(uid)
-    await cq.answer("All set!", show_alert=True)
-    await cq.message.reply_text("✅ Thanks for joining. You can use the menu now.", reply_markup=user_keyboard())
+    await api(cq.answer, "All set!", show_alert=True)
+    await reply(cq.message, "✅ Thanks for joining. You can use the menu now.", reply_markup=user_keyboard())
 
 # Unified user text router
 USER_BAL = "💰 Balance"
@@ -351,25 +1205,30 @@ USER_INVITE = "👥 Invite"
 USER_WITHDRAW = "💵 Withdraw"
 USER_SUPPORT = "📢 Support"
 
-@app.on_message(filters.text & ~filters.command(["start", "admin"]))
+@on_message(filters.text & ~filters.command(["start", "admin"]))
+@serialized
 async def user_text_router(client: Client, m: Message):
     uid = m.from_user.id
 
-    # 🚀 FIX: If admin is in a state, avoid user router
-    if is_admin(uid) and uid in STATE:
-        return  # admin handler will catch this message
+    # 🚀 FIX: If admin is in an admin state, hand the text to the admin router.
+    # Pyrogram stops at the first matching handler in a group, so admin_text_router
+    # never sees plain text on its own.
+    st = STATE.get(uid)
+    if st and not st.get("step", "").startswith("wd_") and is_admin(uid):
+        return await admin_text_router(client, m)
 
     mark_seen(uid)
+    save_profile(m.from_user)
 
     if get_setting("MAINTENANCE") == "1" and not is_admin(uid):
         return
 
     if is_banned(uid):
-        return await m.reply_text("🚫 You are banned from using this bot.")
+        return await reply(m, "🚫 You are banned from using this bot.")
 
     need = await ensure_joined(uid)
     if need:
-        await m.reply_text("Please join required channels first.", reply_markup=user_keyboard())
+        await reply(m, "Please join required channels first.", reply_markup=user_keyboard())
         return await send_join_prompt(m.chat.id)
 
     await maybe_verify_and_credit(uid)
@@ -378,7 +1237,7 @@ async def user_text_router(client: Client, m: Message):
 
     if text == USER_BAL:
         bal = get_balance(uid)
-        return await m.reply_text(
+        return await reply(m, 
             f"🧾 <b>Your Balance:</b> {get_setting('CURRENCY')}{bal:.2f}",
             reply_markup=user_keyboard()
         )
@@ -387,7 +1246,7 @@ async def user_text_router(client: Client, m: Message):
         last = get_last_bonus_date(uid)
         today = date.today().isoformat()
         if last == today:
-            return await m.reply_text(
+            return await reply(m, 
                 "You already claimed today's bonus.",
                 reply_markup=user_keyboard()
             )
@@ -395,16 +1254,16 @@ async def user_text_router(client: Client, m: Message):
         credit(uid, amt)
         set_last_bonus_today(uid)
         bal = get_balance(uid)
-        return await m.reply_text(
+        return await reply(m, 
             f"🎁 Daily bonus credited: {get_setting('CURRENCY')}{amt:.2f}\n"
             f"Current balance: {get_setting('CURRENCY')}{bal:.2f}",
             reply_markup=user_keyboard()
         )
 
     if text == USER_INVITE:
-        bot = await app.get_me()
+        bot = await api(tenant().client.get_me)
         link = f"https://t.me/{bot.username}?start={uid}"
-        return await m.reply_text(
+        return await reply(m, 
             f"👥 <b>Invite & Earn</b>\n"
             f"Share your link: <code>{link}</code>\n"
             f"Referral bonus (on verification): {get_setting('CURRENCY')}"
@@ -414,7 +1273,7 @@ async def user_text_router(client: Client, m: Message):
 
     if text == USER_WITHDRAW:
         STATE[uid] = {"step": "wd_amount"}
-        return await m.reply_text(
+        return await reply(m, 
             f"💳 <b>Withdrawal</b>\n"
             f"Minimum: {get_setting('CURRENCY')}{float(get_setting('MIN_WITHDRAW')):.2f}\n"
             f"Enter the amount you want to withdraw:",
@@ -422,7 +1281,7 @@ async def user_text_router(client: Client, m: Message):
         )
 
     if text == USER_SUPPORT:
-        return await m.reply_text("📢 Support: Please wait, support will contact you.", reply_markup=user_keyboard())
+        return await reply(m, "📢 Support: Please wait, support will contact you.", reply_markup=user_keyboard())
 
     # Withdrawal Flow
     st = STATE.get(uid)
@@ -430,16 +1289,16 @@ async def user_text_router(client: Client, m: Message):
         try:
             amt = float(text)
         except ValueError:
-            return await m.reply_text("Please enter a valid number amount.", reply_markup=user_keyboard())
+            return await reply(m, "Please enter a valid number amount.", reply_markup=user_keyboard())
 
         if amt < float(get_setting("MIN_WITHDRAW")):
-            return await m.reply_text(
+            return await reply(m, 
                 f"Minimum withdrawal is {get_setting('CURRENCY')}{float(get_setting('MIN_WITHDRAW')):.2f}.",
                 reply_markup=user_keyboard()
             )
 
         STATE[uid] = {"step": "wd_upi", "amount": str(amt)}
-        return await m.reply_text("Enter your UPI ID (e.g., username@bank):", reply_markup=user_keyboard())
+        return await reply(m, "Enter your UPI ID (e.g., username@bank):", reply_markup=user_keyboard())
 
     if st and st.get("step") == "wd_upi":
         upi = text
@@ -460,23 +1319,25 @@ async def user_text_router(client: Client, m: Message):
             f"UPI: <code>{upi}</code>"
         )
 
-        return await m.reply_text("✅ Request submitted. Admins will review soon.", reply_markup=user_keyboard())
+        return await reply(m, "✅ Request submitted. Admins will review soon.", reply_markup=user_keyboard())
 # ---------- Admin Panel ----------
 def admin_home():
     return "<b>Admin Panel</b>\nUse the buttons below.", admin_menu()
 
-@app.on_message(filters.command("admin"))
+@on_message(filters.command("admin"))
+@serialized
 async def admin_cmd(client: Client, m: Message):
     if not is_admin(m.from_user.id):
-        return await m.reply_text("Not authorized.")
+        return await reply(m, "Not authorized.")
     text, kb = admin_home()
-    await m.reply_text(text, reply_markup=kb)
+    await reply(m, text, reply_markup=kb)
 
-@app.on_callback_query(filters.regex(r"^A:"))
+@on_callback_query(filters.regex(r"^A:"))
+@serialized
 async def admin_callbacks(client: Client, cq: CallbackQuery):
     uid = cq.from_user.id
     if not is_admin(uid):
-        return await cq.answer("Not authorized.", show_alert=True)
+        return await api(cq.answer, "Not authorized.", show_alert=True)
     code = cq.data.split(":", 1)[1]
 
     if code == "ADMINS":
@@ -486,31 +1347,33 @@ async def admin_callbacks(client: Client, cq: CallbackQuery):
             [InlineKeyboardButton("➖ Remove Admin", callback_data="A:ADM_REM")],
             [InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]
         ])
-        return await cq.message.edit_text("👑 <b>Admins</b>", reply_markup=kb)
+        return await edit(cq.message, "👑 <b>Admins</b>", reply_markup=kb)
 
     if code == "ADM_ADD":
         STATE[uid] = {"step": "add_admin"}
-        return await cq.message.edit_text("Send numeric Telegram user ID to add as admin.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:ADMINS")]]))
+        return await edit(cq.message, "Send numeric Telegram user ID to add as admin.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:ADMINS")]]))
 
     if code == "ADM_REM":
         STATE[uid] = {"step": "rem_admin"}
-        return await cq.message.edit_text("Send numeric Telegram user ID to remove from admins.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:ADMINS")]]))
+        return await edit(cq.message, "Send numeric Telegram user ID to remove from admins.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:ADMINS")]]))
 
     if code == "CHANS":
         chans = list_channels()
         rows = [[InlineKeyboardButton(ch, callback_data=f"A:CHAN_DEL|{ch}") ] for ch in chans] if chans else []
         rows += [[InlineKeyboardButton("➕ Add Channel", callback_data="A:CHAN_ADD")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]]
-        return await cq.message.edit_text("#️⃣ <b>Required Channels</b>", reply_markup=InlineKeyboardMarkup(rows))
+        return await edit(cq.message, "#️⃣ <b>Required Channels</b>", reply_markup=InlineKeyboardMarkup(rows))
 
     if code.startswith("CHAN_DEL|"):
         ch = code.split("|",1)[1]
         ok = remove_channel(ch)
-        await cq.answer("Removed." if ok else "Not found.", show_alert=True)
+        if ok:
+            audit(uid, "CHAN_DEL", before=ch)
+        await api(cq.answer, "Removed." if ok else "Not found.", show_alert=True)
         return await admin_callbacks(client, CallbackQuery(id=cq.id, from_user=cq.from_user, chat_instance=cq.chat_instance, data="A:CHANS", message=cq.message))
 
     if code == "CHAN_ADD":
         STATE[uid] = {"step": "add_channel"}
-        return await cq.message.edit_text("Send channel @username or https://t.me/ link to require.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:CHANS")]]))
+        return await edit(cq.message, "Send channel @username or https://t.me/ link to require.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:CHANS")]]))
 
     if code == "SET":
         kb = InlineKeyboardMarkup([
@@ -520,274 +1383,531 @@ async def admin_callbacks(client: Client, cq: CallbackQuery):
             [InlineKeyboardButton("CURRENCY", callback_data="A:SETK|CURRENCY")],
             [InlineKeyboardButton("WELCOME_TEXT", callback_data="A:SETK|WELCOME_TEXT")],
             [InlineKeyboardButton("ACTIVE_DAYS", callback_data="A:SETK|ACTIVE_DAYS")],
+            [InlineKeyboardButton("ARCHIVE_DAYS", callback_data="A:SETK|ARCHIVE_DAYS")],
             [InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]
         ])
-        current = (f"<b>Settings</b>\nDAILY_BONUS: {get_setting('DAILY_BONUS')}\nREFERRAL_BONUS: {get_setting('REFERRAL_BONUS')}\nMIN_WITHDRAW: {get_setting('MIN_WITHDRAW')}\nCURRENCY: {get_setting('CURRENCY')}\nACTIVE_DAYS: {get_setting('ACTIVE_DAYS')}\nWELCOME_TEXT: {get_setting('WELCOME_TEXT')[:80]}...")
-        return await cq.message.edit_text(current, reply_markup=kb)
+        current = (f"<b>Settings</b>\nDAILY_BONUS: {get_setting('DAILY_BONUS')}\nREFERRAL_BONUS: {get_setting('REFERRAL_BONUS')}\nMIN_WITHDRAW: {get_setting('MIN_WITHDRAW')}\nCURRENCY: {get_setting('CURRENCY')}\nACTIVE_DAYS: {get_setting('ACTIVE_DAYS')}\nARCHIVE_DAYS: {get_setting('ARCHIVE_DAYS')}\nWELCOME_TEXT: {get_setting('WELCOME_TEXT')[:80]}...")
+        return await edit(cq.message, current, reply_markup=kb)
 
     if code.startswith("SETK|"):
         key = code.split("|",1)[1]
         STATE[uid] = {"step": "set_value", "key": key}
-        return await cq.message.edit_text(f"Send new value for <b>{key}</b>.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:SET")]]))
+        return await edit(cq.message, f"Send new value for <b>{key}</b>.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:SET")]]))
 
     if code == "MAINT":
         current = get_setting("MAINTENANCE")
         new = "0" if current == "1" else "1"
         set_setting("MAINTENANCE", new)
-        return await cq.message.edit_text(f"🛠 Maintenance is now {'ON' if new=='1' else 'OFF'}.", reply_markup=admin_menu())
+        audit(uid, "MAINTENANCE", before=current, after=new)
+        return await edit(cq.message, f"🛠 Maintenance is now {'ON' if new=='1' else 'OFF'}.", reply_markup=admin_menu())
 
     if code == "BC":
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("Send to ALL", callback_data="A:BCALL")],[InlineKeyboardButton("Send to ACTIVE", callback_data="A:BCACT")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]])
-        return await cq.message.edit_text("📣 Broadcast mode?", reply_markup=kb)
+        return await edit(cq.message, "📣 Broadcast mode?", reply_markup=kb)
 
     if code in ("BCALL", "BCACT"):
         STATE[uid] = {"step": "broadcast", "mode": code}
-        return await cq.message.edit_text("Send the broadcast message text.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BC")]]))
+        return await edit(cq.message, "Send the broadcast message text.\n\nOr press Back.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BC")]]))
 
     if code == "PAYOUTS":
         con = db(); cur = con.cursor()
         cur.execute("SELECT id,user_id,amount,upi FROM withdrawals WHERE status='pending' ORDER BY id DESC LIMIT 10")
         rows = cur.fetchall(); con.close()
         if not rows:
-            return await cq.message.edit_text("No pending withdrawals.", reply_markup=admin_menu())
+            return await edit(cq.message, "No pending withdrawals.", reply_markup=admin_menu())
         buttons = []
         for r in rows:
             buttons.append([InlineKeyboardButton(f"#{r['id']} {get_setting('CURRENCY')}{r['amount']} | {r['upi']}", callback_data=f"A:WD_VIEW|{r['id']}")])
         buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")])
-        return await cq.message.edit_text("💸 <b>Pending Withdrawals</b>", reply_markup=InlineKeyboardMarkup(buttons))
+        return await edit(cq.message, "💸 <b>Pending Withdrawals</b>", reply_markup=InlineKeyboardMarkup(buttons))
 
     if code.startswith("WD_VIEW|"):
         wid = int(code.split("|",1)[1])
-        con = db(); cur = con.cursor()
-        cur.execute("SELECT id,user_id,amount,upi,status FROM withdrawals WHERE id=?", (wid,))
-        r = cur.fetchone(); con.close()
+        r = get_withdrawal(wid)
         if not r:
-            return await cq.answer("Not found.", show_alert=True)
-        kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Approve", callback_data=f"A:WD_OK|{wid}")],
-            [InlineKeyboardButton("❌ Reject", callback_data=f"A:WD_REJ|{wid}")],
-            [InlineKeyboardButton("⬅️ Back", callback_data="A:PAYOUTS")]
-        ])
+            return await api(cq.answer, "Not found.", show_alert=True)
+        rows = [[InlineKeyboardButton("⬅️ Back", callback_data="A:PAYOUTS")]]
+        if r["status"] == "pending":
+            # Settled (possibly archived) requests can't be decided again.
+            rows[:0] = [[InlineKeyboardButton("✅ Approve", callback_data=f"A:WD_OK|{wid}")],
+                        [InlineKeyboardButton("❌ Reject", callback_data=f"A:WD_REJ|{wid}")]]
+        kb = InlineKeyboardMarkup(rows)
         text = (f"ID: #{r['id']}\nUser: <a href='tg://user?id={r['user_id']}'>{r['user_id']}</a>\nAmount: {get_setting('CURRENCY')}{r['amount']:.2f}\nUPI: <code>{r['upi']}</code>\nStatus: {r['status']}")
-        return await cq.message.edit_text(text, reply_markup=kb)
+        return await edit(cq.message, text, reply_markup=kb)
 
     if code.startswith("WD_OK|"):
         wid = int(code.split("|",1)[1])
-        await finalize_withdrawal(wid, approve=True)
-        await cq.answer("Approved.")
+        await finalize_withdrawal(wid, approve=True, actor=uid)
+        await api(cq.answer, "Approved.")
         return await admin_callbacks(client, CallbackQuery(id=cq.id, from_user=cq.from_user, chat_instance=cq.chat_instance, data="A:PAYOUTS", message=cq.message))
 
     if code.startswith("WD_REJ|"):
         wid = int(code.split("|",1)[1])
-        await finalize_withdrawal(wid, approve=False)
-        await cq.answer("Rejected.")
+        await finalize_withdrawal(wid, approve=False, actor=uid)
+        await api(cq.answer, "Rejected.")
         return await admin_callbacks(client, CallbackQuery(id=cq.id, from_user=cq.from_user, chat_instance=cq.chat_instance, data="A:PAYOUTS", message=cq.message))
 
     if code == "BANSET":
-        kb = InlineKeyboardMarkup([[InlineKeyboardButton("🚫 Ban User", callback_data="A:BAN")],[InlineKeyboardButton("✅ Unban User", callback_data="A:UNBAN")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]])
-        return await cq.message.edit_text("Ban/Unban users.", reply_markup=kb)
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton("🚫 Ban User", callback_data="A:BAN")],[InlineKeyboardButton("✅ Unban User", callback_data="A:UNBAN")],[InlineKeyboardButton("📂 Bulk Ban (file)", callback_data="A:BULK|BAN")],[InlineKeyboardButton("📂 Bulk Unban (file)", callback_data="A:BULK|UNBAN")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]])
+        return await edit(cq.message, "Ban/Unban users.", reply_markup=kb)
 
     if code in ("BAN", "UNBAN"):
         STATE[uid] = {"step": "ban" if code=="BAN" else "unban"}
-        return await cq.message.edit_text("Send user ID.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BANSET")]]))
+        return await edit(cq.message, "Send user ID.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BANSET")]]))
 
     if code == "BALSET":
-        kb = InlineKeyboardMarkup([[InlineKeyboardButton("➕ Add Balance", callback_data="A:BALADD")],[InlineKeyboardButton("➖ Remove Balance", callback_data="A:BALREM")],[InlineKeyboardButton("🧹 Reset Balance", callback_data="A:BALRST")],[InlineKeyboardButton("🎁 Reset Bonus Flag", callback_data="A:BONUSRST")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]])
-        return await cq.message.edit_text("Balance operations.", reply_markup=kb)
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton("➕ Add Balance", callback_data="A:BALADD")],[InlineKeyboardButton("➖ Remove Balance", callback_data="A:BALREM")],[InlineKeyboardButton("🧹 Reset Balance", callback_data="A:BALRST")],[InlineKeyboardButton("🎁 Reset Bonus Flag", callback_data="A:BONUSRST")],[InlineKeyboardButton("📂 Bulk Credit (file)", callback_data="A:BULK|CREDIT")],[InlineKeyboardButton("📂 Bulk Debit (file)", callback_data="A:BULK|DEBIT")],[InlineKeyboardButton("📂 Bulk Bonus Reset (file)", callback_data="A:BULK|BONUSRST")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]])
+        return await edit(cq.message, "Balance operations.", reply_markup=kb)
 
     if code in ("BALADD", "BALREM", "BALRST", "BONUSRST"):
         STATE[uid] = {"step": code.lower()}
         prompt = {"BALADD": "Send: user_id amount", "BALREM": "Send: user_id amount", "BALRST": "Send: user_id", "BONUSRST": "Send: user_id (clear daily bonus claimed for today)"}[code]
-        return await cq.message.edit_text(prompt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BALSET")]]))
+        return await edit(cq.message, prompt, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BALSET")]]))
+
+    if code.startswith("BULK|"):
+        op = code.split("|",1)[1]
+        if op not in BULK_OPS:
+            return await api(cq.answer, "Unknown operation.", show_alert=True)
+        STATE[uid] = {"step": "bulk", "op": op}
+        fmt = "user_id,amount" if BULK_OPS[op][1] else "user_id"
+        back = "A:BANSET" if op in ("BAN", "UNBAN") else "A:BALSET"
+        return await edit(cq.message, f"📂 <b>Bulk {BULK_OPS[op][0]}</b>\nUpload a .csv or .txt file with one <code>{fmt}</code> per line.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data=back)]]))
 
     if code == "LOOKUP":
         STATE[uid] = {"step": "lookup"}
-        return await cq.message.edit_text("Send user ID to lookup.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]]))
+        return await edit(cq.message, "Send user ID, @username or name to lookup.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]]))
+
+    if code.startswith("SRCH|"):
+        page = int(code.split("|",1)[1])
+        q = SEARCHES.get(uid)
+        if not q:
+            return await api(cq.answer, "Search expired.", show_alert=True)
+        text, kb = search_page(q, page)
+        return await edit(cq.message, text, reply_markup=kb)
+
+    if code.startswith("USR|"):
+        u = get_user(int(code.split("|",1)[1]))
+        if not u:
+            return await api(cq.answer, "Not found.", show_alert=True)
+        return await reply(cq.message, fmt_user(u))
 
     if code == "EXPORT":
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("📄 Users (TXT)", callback_data="A:EX_USERS")],[InlineKeyboardButton("📊 Withdrawals (CSV)", callback_data="A:EX_WD")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]])
-        return await cq.message.edit_text("Choose export type.", reply_markup=kb)
+        return await edit(cq.message, "Choose export type.", reply_markup=kb)
 
     if code == "EX_USERS":
         path = await export_users()
-        return await cq.message.reply_document(path, caption="Users export")
+        return await reply_doc(cq.message, path, caption="Users export")
 
     if code == "EX_WD":
         path = await export_withdrawals()
-        return await cq.message.reply_document(path, caption="Withdrawals export")
+        return await reply_doc(cq.message, path, caption="Withdrawals export")
+
+    if code == "AUDIT":
+        STATE[uid] = {"step": "audit"}
+        return await edit(cq.message, "📜 <b>Audit Log</b>\nSend <code>actor user_id</code>, <code>user user_id</code> or <code>all</code>.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]]))
+
+    if code == "STATS":
+        st = SCHED.stats()
+        activity = tenant().activity
+        text = ("📈 <b>Stats</b>\n<b>Update scheduler</b>\n"
+                + "\n".join(f"{k}: {v}" for k, v in st.items())
+                + f"\n<b>Outbound queue</b>\npending: {OUTBOX.queue.qsize() if OUTBOX.queue else 0}"
+                + f"\n<b>Activity</b>\nDAU: {activity.active(1)}\nWAU: {activity.active(7)}\nMAU: {activity.active(30)}"
+                + "\n<b>Retention</b> (cohort: size D1 D7)")
+        for age, d in enumerate(activity.last_days(8)[1:], 1):
+            size, d1 = activity.retention(d, 1)
+            if size:
+                # D7 only exists once the cohort is a week old.
+                d7 = f"{activity.retention(d, 7)[1] * 100 // size}%" if age >= 7 else "–"
+                text += f"\n{d}: {size} {d1 * 100 // size}% {d7}"
+        return await edit(cq.message, text, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Refresh", callback_data="A:STATS")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]]))
 
     if code == "OWNER":
-        if uid != OWNER_ID:
-            return await cq.answer("Owner only.", show_alert=True)
+        if uid != tenant().owner_id:
+            return await api(cq.answer, "Owner only.", show_alert=True)
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("🗂 DB Backup", callback_data="A:BK_DB")],[InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")]])
-        return await cq.message.edit_text("Owner tools.", reply_markup=kb)
+        return await edit(cq.message, "Owner tools.", reply_markup=kb)
 
     if code == "BK_DB":
-        if uid != OWNER_ID:
-            return await cq.answer("Owner only.", show_alert=True)
-        return await cq.message.reply_document(DB_PATH, caption="DB backup")
+        if uid != tenant().owner_id:
+            return await api(cq.answer, "Owner only.", show_alert=True)
+        return await reply_doc(cq.message, tenant().db_path, caption="DB backup")
 
     if code == "BACK":
         text, kb = admin_home()
-        return await cq.message.edit_text(text, reply_markup=kb)
+        return await edit(cq.message, text, reply_markup=kb)
 
 # Admin text flows (correct: filters.create with is_admin)
-@app.on_message(filters.text)
+@on_message(filters.text)
+@serialized
 async def admin_text_router(client: Client, m: Message):
     uid = m.from_user.id
 
     # if admin + in STATE => process admin input
-    if is_admin(uid) and uid in STATE:
-
-        st = STATE[uid]
-        step = st.get("step")
-
-        # (then your existing admin logic continues…)
-    
+    st = STATE.get(uid) if is_admin(uid) else None
     if not st:
         return
 
     step = st.get("step")
     if step == "set_value":
         key = st.get("key")
+        old = get_setting(key)
         set_setting(key, m.text.strip())
+        audit(uid, "SET", before=f"{key}={old}", after=f"{key}={m.text.strip()}")
         STATE.pop(uid, None)
-        return await m.reply_text(f"✅ {key} updated successfully.")
+        return await reply(m, f"✅ {key} updated successfully.")
 
     if step == "add_admin":
         try:
             new_uid = int(m.text.strip())
         except ValueError:
-            return await m.reply_text("Send numeric user ID.")
+            return await reply(m, "Send numeric user ID.")
         ok = add_admin(new_uid)
+        if ok:
+            audit(uid, "ADM_ADD", new_uid)
         STATE.pop(uid, None)
-        return await m.reply_text("✅ Added." if ok else "Already admin or invalid.")
+        return await reply(m, "✅ Added." if ok else "Already admin or invalid.")
 
     if step == "rem_admin":
         try:
             rem_uid = int(m.text.strip())
         except ValueError:
-            return await m.reply_text("Send numeric user ID.")
+            return await reply(m, "Send numeric user ID.")
         ok = remove_admin(rem_uid)
+        if ok:
+            audit(uid, "ADM_REM", rem_uid)
         STATE.pop(uid, None)
-        return await m.reply_text("✅ Removed." if ok else "Not an admin.")
+        return await reply(m, "✅ Removed." if ok else "Not an admin.")
 
     if step == "add_channel":
         ok = add_channel(m.text.strip())
+        if ok:
+            audit(uid, "CHAN_ADD", after=m.text.strip())
         STATE.pop(uid, None)
-        return await m.reply_text("✅ Channel added." if ok else "Could not add (maybe duplicate).")
+        return await reply(m, "✅ Channel added." if ok else "Could not add (maybe duplicate).")
 
     if step == "broadcast":
         mode = st.get("mode", "BCALL")
-        if mode == "BCALL":
-            await broadcast(m.text)
-        else:
-            await broadcast(m.text, active_only=True)
+        spawn(broadcast(m.text, active_only=(mode != "BCALL")))
+        audit(uid, mode, after=m.text[:200])
         STATE.pop(uid, None)
-        return await m.reply_text("✅ Broadcast queued.")
+        return await reply(m, "✅ Broadcast queued.")
 
     if step == "ban":
         try:
             target = int(m.text.strip())
         except ValueError:
-            return await m.reply_text("Send numeric user ID.")
+            return await reply(m, "Send numeric user ID.")
+        audit(uid, "BAN", target, before=int(is_banned(target)), after=1)
         set_ban(target, True)
         STATE.pop(uid, None)
-        return await m.reply_text("🚫 User banned.")
+        return await reply(m, "🚫 User banned.")
 
     if step == "unban":
         try:
             target = int(m.text.strip())
         except ValueError:
-            return await m.reply_text("Send numeric user ID.")
+            return await reply(m, "Send numeric user ID.")
+        audit(uid, "UNBAN", target, before=int(is_banned(target)), after=0)
         set_ban(target, False)
         STATE.pop(uid, None)
-        return await m.reply_text("✅ User unbanned.")
+        return await reply(m, "✅ User unbanned.")
 
     if step == "baladd":
         try:
             tid, amt = m.text.strip().split()
             tid = int(tid); amt = float(amt)
         except Exception:
-            return await m.reply_text("Format: user_id amount")
+            return await reply(m, "Format: user_id amount")
+        before = get_balance(tid)
         credit(tid, amt)
+        audit(uid, "BALADD", tid, before, get_balance(tid))
         STATE.pop(uid, None)
-        return await m.reply_text("✅ Balance added.")
+        return await reply(m, "✅ Balance added.")
 
     if step == "balrem":
         try:
             tid, amt = m.text.strip().split()
             tid = int(tid); amt = float(amt)
         except Exception:
-            return await m.reply_text("Format: user_id amount")
+            return await reply(m, "Format: user_id amount")
+        before = get_balance(tid)
         ok = debit(tid, amt)
+        if ok:
+            audit(uid, "BALREM", tid, before, get_balance(tid))
         STATE.pop(uid, None)
-        return await m.reply_text("✅ Balance removed." if ok else "Insufficient balance.")
+        return await reply(m, "✅ Balance removed." if ok else "Insufficient balance.")
 
     if step == "balrst":
         try:
             tid = int(m.text.strip())
         except Exception:
-            return await m.reply_text("Send user_id")
+            return await reply(m, "Send user_id")
+        audit(uid, "BALRST", tid, get_balance(tid), 0)
         con = db(); cur = con.cursor()
         cur.execute("UPDATE users SET balance=0 WHERE user_id=?", (tid,))
         con.commit(); con.close()
         STATE.pop(uid, None)
-        return await m.reply_text("🧹 Balance reset.")
+        return await reply(m, "🧹 Balance reset.")
 
     if step == "bonusrst":
         try:
             tid = int(m.text.strip())
         except Exception:
-            return await m.reply_text("Send user_id")
+            return await reply(m, "Send user_id")
+        audit(uid, "BONUSRST", tid, get_last_bonus_date(tid), None)
         con = db(); cur = con.cursor()
         cur.execute("UPDATE users SET last_bonus_date=NULL WHERE user_id=?", (tid,))
         con.commit(); con.close()
         STATE.pop(uid, None)
-        return await m.reply_text("🎁 Daily bonus reset for user.")
+        return await reply(m, "🎁 Daily bonus reset for user.")
 
     if step == "lookup":
-        try:
-            tid = int(m.text.strip())
-        except Exception:
-            return await m.reply_text("Send user_id")
-        u = get_user(tid)
+        q = m.text.strip()
+        STATE.pop(uid, None)
+        if not q.isdigit():
+            SEARCHES[uid] = q
+            text, kb = search_page(q, 0)
+            return await reply(m, text, reply_markup=kb)
+        u = get_user(int(q))
         if not u:
-            STATE.pop(uid, None)
-            return await m.reply_text("Not found.")
-        text = (f"User: {u['user_id']}\nJoined: {u['joined_at']}\nReferrer: {u['referrer_id']}\nBalance: {get_setting('CURRENCY')}{float(u['balance']):.2f}\nVerified: {bool(u['verified'])}\nRef bonus paid: {bool(u['referred_bonus_paid'])}\nBanned: {bool(u['is_banned'])}\nLast seen: {u['last_seen']}")
+            return await reply(m, "Not found.")
+        return await reply(m, fmt_user(u))
+
+    if step == "audit":
+        parts = m.text.strip().split()
+        try:
+            if parts[0].lower() == "all":
+                rows = query_audit()
+            elif parts[0].lower() == "actor":
+                rows = query_audit(actor=int(parts[1]))
+            elif parts[0].lower() == "user":
+                rows = query_audit(target=int(parts[1]))
+            else:
+                raise ValueError
+        except (ValueError, IndexError):
+            return await reply(m, "Format: actor user_id | user user_id | all")
         STATE.pop(uid, None)
-        return await m.reply_text(text)
+        if not rows:
+            return await reply(m, "No audit entries.")
+        text = "📜 <b>Audit Log</b>"
+        for i, r in enumerate(rows):
+            line = "\n" + fmt_audit(r)
+            if len(text) + len(line) > 3900:  # stay under Telegram's 4096-char limit
+                text += f"\n… {len(rows) - i} more (narrow the filter)"
+                break
+            text += line
+        return await reply(m, text)
+
+@on_message(filters.document)
+@serialized
+async def admin_document_router(client: Client, m: Message):
+    uid = m.from_user.id
+    st = STATE.get(uid)
+    if not (st and st.get("step") == "bulk" and is_admin(uid)):
+        return
+    op = st["op"]
+    if (m.document.file_size or 0) > BULK_MAX_BYTES:
+        return await reply(m, f"File too large (max {BULK_MAX_BYTES // (1024 * 1024)} MB).")
+    STATE.pop(uid, None)
+    buf = await api(m.download, in_memory=True)
+    buf.seek(0)
+    ok, errors = await run_bulk(op, io.TextIOWrapper(buf, encoding="utf-8", errors="replace"), uid)
+    audit(uid, f"BULK_{op}", after=f"{ok} ok, {len(errors)} errors ({m.document.file_name})")
+    text = f"📂 <b>Bulk {BULK_OPS[op][0]}</b>\nApplied: {ok}\nErrors: {len(errors)}"
+    if errors:
+        text += "\n" + "\n".join(f"line {n}: {html.escape(e)}" for n, e in errors[:20])
+    if len(errors) > 20:
+        path = f"{tenant().name}-bulk_errors.csv"
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["line", "error"])
+            writer.writerows(errors)
+        await reply(m, text + f"\n… {len(errors) - 20} more in file.")
+        return await reply_doc(m, path, caption="Bulk error report")
+    return await reply(m, text)
+
+# ---------- Bulk Operations ----------
+# op -> (label, needs amount, UPDATE taking (amount?, user_id))
+BULK_OPS: Dict[str, Tuple[str, bool, str]] = {
+    "CREDIT": ("Credit", True, "UPDATE users SET balance = COALESCE(balance,0)+? WHERE user_id=?"),
+    "DEBIT": ("Debit", True, "UPDATE users SET balance = COALESCE(balance,0)-? WHERE user_id=?"),
+    "BAN": ("Ban", False, "UPDATE users SET is_banned=1 WHERE user_id=?"),
+    "UNBAN": ("Unban", False, "UPDATE users SET is_banned=0 WHERE user_id=?"),
+    "BONUSRST": ("Bonus Reset", False, "UPDATE users SET last_bonus_date=NULL WHERE user_id=?"),
+}
+
+def _parse_bulk_line(parts: List[str], need_amount: bool) -> Tuple[Optional[Tuple[int, float]], Optional[str]]:
+    try:
+        tid = int(parts[0])
+    except ValueError:
+        return None, f"bad user_id {parts[0][:32]!r}"
+    if not -2**63 <= tid < 2**63:
+        return None, "user_id out of range"
+    if not need_amount:
+        return (tid, 0.0), None
+    try:
+        amt = float(parts[1])
+    except (IndexError, ValueError):
+        return None, "missing or bad amount"
+    if not amt > 0:
+        return None, "amount must be positive"
+    if not amt <= BULK_MAX_AMOUNT:
+        return None, f"amount above {BULK_MAX_AMOUNT:g}"
+    return (tid, amt), None
+
+def parse_bulk(f, need_amount: bool) -> Iterator[Tuple[int, Optional[Tuple[int, float]], Optional[str]]]:
+    """Yield (line_no, (user_id, amount), None) or (line_no, None, error), one line at a time."""
+    first = True
+    for n, line in enumerate(f, 1):
+        line = line.strip().lstrip("\ufeff")
+        if not line or line.startswith("#"):
+            continue
+        parts = [p for p in re.split(r"[,;\s]+", line) if p]
+        if not parts:
+            continue  # separators only, e.g. Excel's blank row ","
+        if first:
+            first = False
+            if not parts[0].lstrip("-").isdigit():
+                continue  # header row
+        try:
+            row, err = _parse_bulk_line(parts, need_amount)
+        except Exception as e:
+            # A single malformed line must never abort the whole file.
+            row, err = None, f"malformed line ({type(e).__name__})"
+        yield n, row, err
+
+def apply_bulk_chunk(op: str, rows: List[Tuple[int, int, float]], actor: int) -> Tuple[int, List[Tuple[int, str]]]:
+    """Validate and apply one chunk of (line_no, user_id, amount) in a single transaction."""
+    _, need_amount, sql = BULK_OPS[op]
+    errors: List[Tuple[int, str]] = []
+    params = []
+    trail = []
+    now = datetime.utcnow().isoformat()
+    con = db()
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        ids = list({r[1] for r in rows})
+        known: Dict[int, sqlite3.Row] = {}
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            for u in con.execute(f"SELECT user_id, COALESCE(balance,0) AS balance, is_banned, last_bonus_date FROM users "
+                                 f"WHERE user_id IN ({','.join('?' * len(part))})", part):
+                known[u["user_id"]] = u
+        balances = {k: float(v["balance"]) for k, v in known.items()}
+        for n, tid, amt in rows:
+            u = known.get(tid)
+            if u is None:
+                errors.append((n, f"unknown user {tid}")); continue
+            if op == "DEBIT" and balances[tid] < amt:
+                errors.append((n, f"insufficient balance for {tid} ({balances[tid]:.2f} < {amt:.2f})")); continue
+            if op == "CREDIT":
+                before, after = balances[tid], balances[tid] + amt
+            elif op == "DEBIT":
+                before, after = balances[tid], balances[tid] - amt
+            elif op == "BONUSRST":
+                before, after = u["last_bonus_date"], None
+            else:
+                before, after = u["is_banned"], int(op == "BAN")
+            if need_amount:
+                balances[tid] = after
+            params.append((amt, tid) if need_amount else (tid,))
+            trail.append((now, actor, f"BULK_{op}", tid,
+                          None if before is None else str(before),
+                          None if after is None else str(after)))
+        con.executemany(sql, params)
+        # Audit rows ride in the same transaction instead of the audit buffer.
+        con.executemany("INSERT INTO audit_log(ts, actor, action, target, before, after) VALUES(?,?,?,?,?,?)", trail)
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+    return len(params), errors
+
+async def run_bulk(op: str, f, actor: int) -> Tuple[int, List[Tuple[int, str]]]:
+    applied = 0
+    errors: List[Tuple[int, str]] = []
+    chunk: List[Tuple[int, int, float]] = []
+    try:
+        for n, row, err in parse_bulk(f, BULK_OPS[op][1]):
+            if err:
+                errors.append((n, err)); continue
+            chunk.append((n,) + row)
+            if len(chunk) >= BULK_CHUNK:
+                ok, errs = apply_bulk_chunk(op, chunk, actor)
+                applied += ok; errors += errs; chunk = []
+                await asyncio.sleep(0)
+        if chunk:
+            ok, errs = apply_bulk_chunk(op, chunk, actor)
+            applied += ok; errors += errs; chunk = []
+    except Exception as e:
+        # Earlier chunks are committed; report them and stop at the failed one.
+        log.exception("bulk %s failed", op)
+        errors += [(n, f"not applied: {type(e).__name__}") for n, _, _ in chunk]
+        errors.append((0, f"aborted ({type(e).__name__}); later lines were not processed"))
+    errors.sort()
+    return applied, errors
 
 # ---------- Admin Helpers ----------
+SEARCHES = TenantMap()   # admin id -> last lookup query, for paging
+
+def fmt_user(u: sqlite3.Row) -> str:
+    name = " ".join(p for p in (u["first_name"], u["last_name"]) if p)
+    return (f"User: {u['user_id']}\nUsername: {'@' + u['username'] if u['username'] else '-'}\nName: {html.escape(name) or '-'}\nJoined: {u['joined_at']}\nReferrer: {u['referrer_id']}\nBalance: {get_setting('CURRENCY')}{float(u['balance']):.2f}\nVerified: {bool(u['verified'])}\nRef bonus paid: {bool(u['referred_bonus_paid'])}\nBanned: {bool(u['is_banned'])}\nLast seen: {u['last_seen']}"
+            + "".join(f"\nWD #{w['id']} {get_setting('CURRENCY')}{float(w['amount']):.2f} {w['status']} {w['created_at'][:10]}"
+                      for w in user_withdrawals(u["user_id"])))
+
+def search_page(q: str, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    rows, more = search_users(q, page)
+    buttons = []
+    for r in rows:
+        name = " ".join(p for p in (r["first_name"], r["last_name"]) if p)
+        label = f"{r['user_id']} {'@' + r['username'] if r['username'] else ''} {name}".strip()
+        buttons.append([InlineKeyboardButton(label[:60], callback_data=f"A:USR|{r['user_id']}")])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Prev", callback_data=f"A:SRCH|{page-1}"))
+    if more:
+        nav.append(InlineKeyboardButton("Next ▶️", callback_data=f"A:SRCH|{page+1}"))
+    if nav:
+        buttons.append(nav)
+    buttons.append([InlineKeyboardButton("⬅️ Back", callback_data="A:BACK")])
+    text = f"🔎 Results for <code>{html.escape(q)}</code> (page {page+1})" if rows else "No users found."
+    return text, InlineKeyboardMarkup(buttons)
+
 async def notify_admins(text: str):
     con = db(); cur = con.cursor()
     cur.execute("SELECT user_id FROM admins")
     admins = [r[0] for r in cur.fetchall()]
     con.close()
     for a in admins:
-        try:
-            await app.send_message(a, text)
-        except Exception:
-            pass
+        post(a, text, PRIO_ADMIN)
 
 async def broadcast(text: str, active_only: bool=False):
     days = int(get_setting("ACTIVE_DAYS") or "30")
     limit_date = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    con = db(); cur = con.cursor()
-    if active_only:
-        cur.execute("SELECT user_id FROM users WHERE last_seen >= ?", (limit_date,))
+    activity = tenant().activity
+    if active_only and activity.coverage() >= days:
+        users = activity.audience(days)
     else:
-        cur.execute("SELECT user_id FROM users")
-    users = [r[0] for r in cur.fetchall()]
-    con.close()
+        # Bitmaps don't reach back far enough yet; fall back to last_seen.
+        con = db(); cur = con.cursor()
+        if active_only:
+            cur.execute("SELECT user_id FROM users WHERE last_seen >= ?", (limit_date,))
+        else:
+            cur.execute("SELECT user_id FROM users")
+        users = [r[0] for r in cur.fetchall()]
+        con.close()
+    # Bounded window so a huge audience never floods the queue or memory.
+    window = asyncio.Semaphore(SEND_WORKERS * 4)
     for uid in users:
-        try:
-            await app.send_message(uid, text)
-        except Exception:
-            pass
+        await window.acquire()
+        post(uid, text, PRIO_BULK).add_done_callback(lambda _f: window.release())
 
-async def finalize_withdrawal(wid: int, approve: bool):
+async def finalize_withdrawal(wid: int, approve: bool, actor: int = 0):
     con = db(); cur = con.cursor()
     cur.execute("SELECT id,user_id,amount,status FROM withdrawals WHERE id=?", (wid,))
     r = cur.fetchone()
@@ -800,22 +1920,18 @@ async def finalize_withdrawal(wid: int, approve: bool):
             cur.execute("UPDATE users SET balance=balance-? WHERE user_id=?", (float(r["amount"]), r["user_id"]))
             cur.execute("UPDATE withdrawals SET status='approved' WHERE id=?", (wid,))
             con.commit(); con.close()
-            try:
-                await app.send_message(r["user_id"], f"✅ Withdrawal approved for {get_setting('CURRENCY')}{float(r['amount']):.2f}. Payment processing.")
-            except Exception:
-                pass
+            audit(actor, "WD_OK", r["user_id"], f"#{wid} pending", f"#{wid} approved")
+            post(r["user_id"], f"✅ Withdrawal approved for {get_setting('CURRENCY')}{float(r['amount']):.2f}. Payment processing.")
             return
         else:
             approve = False
     cur.execute("UPDATE withdrawals SET status='rejected' WHERE id=?", (wid,))
     con.commit(); con.close()
-    try:
-        await app.send_message(r["user_id"], "❌ Withdrawal rejected (insufficient balance or other issue).")
-    except Exception:
-        pass
+    audit(actor, "WD_REJ", r["user_id"], f"#{wid} pending", f"#{wid} rejected")
+    post(r["user_id"], "❌ Withdrawal rejected (insufficient balance or other issue).")
 
 async def export_users() -> str:
-    path = "users.txt"
+    path = f"{tenant().name}-users.txt"
     con = db(); cur = con.cursor()
     cur.execute("SELECT user_id FROM users ORDER BY user_id ASC")
     ids = [str(r[0]) for r in cur.fetchall()]
@@ -825,23 +1941,42 @@ async def export_users() -> str:
     return path
 
 async def export_withdrawals() -> str:
-    path = "withdrawals.csv"
-    con = db(); cur = con.cursor()
-    cur.execute("SELECT id,user_id,amount,upi,status,created_at FROM withdrawals ORDER BY id ASC")
-    rows = cur.fetchall()
-    con.close()
-    import csv
+    path = f"{tenant().name}-withdrawals.csv"
+    con = db_wd(); cur = con.cursor()
+    cur.execute(f"SELECT * FROM ({wd_all()}) ORDER BY id ASC")
     with open(path, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["id","user_id","amount","upi","status","created_at"])
-        for r in rows:
+        for r in cur:
             writer.writerow([r["id"], r["user_id"], r["amount"], r["upi"], r["status"], r["created_at"]])
+    con.close()
     return path
 
 # ---------- Boot ----------
+async def main():
+    for t in TENANTS:
+        await t.build().start()
+    OUTBOX.start()
+    SCHED.start()
+    spawn(audit_flusher())
+    spawn(archiver())
+    spawn(activity_flusher())
+    await idle()
+    await SCHED.stop()
+    await OUTBOX.stop()
+    for t in TENANTS:
+        with use_tenant(t):
+            flush_audit()
+            t.activity.flush()
+        await t.client.stop()
+    POOL.close_all()
+
 if __name__ == "__main__":
-    if not (API_ID and API_HASH and BOT_TOKEN and OWNER_ID):
-        raise SystemExit("Please set API_ID, API_HASH, BOT_TOKEN, OWNER_ID in environment or .env")
-    init_db()
-    print("RupeeRocket bot starting...")
-    app.run()
+    load_tenants()
+    for t in TENANTS:
+        if not (t.api_id and t.api_hash and t.bot_token and t.owner_id):
+            raise SystemExit(f"Please set API_ID, API_HASH, BOT_TOKEN, OWNER_ID for {t.name} in environment, .env or {TENANTS_FILE}")
+        with use_tenant(t):
+            init_db()
+    print(f"RupeeRocket bot starting ({len(TENANTS)} bot(s))...")
+    asyncio.get_event_loop().run_until_complete(main())